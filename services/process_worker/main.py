@@ -13,6 +13,7 @@ SERVICE_NAME = os.environ.get("SERVICE_NAME", "process-worker")
 REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
 DB_PATH = os.environ.get("DB_PATH", "events.db")
 CPU_WORK_MS = int(os.environ.get("CPU_WORK_MS", 0))
+WORKER_BATCH_SIZE = int(os.environ.get("WORKER_BATCH_SIZE", 256))
 
 # --- Observability ---
 tracer, meter = setup_observability(SERVICE_NAME)
@@ -25,6 +26,7 @@ worker_events_consumed = meter.create_counter("worker.events.consumed")
 worker_events_processed = meter.create_counter("worker.events.processed")
 worker_event_processing_duration = meter.create_histogram("worker.event.processing.duration", unit="s")
 worker_loop_errors = meter.create_counter("worker.loop.errors")
+worker_events_malformed = meter.create_counter("worker.events.malformed")
 
 def db_health_callback(result):
     yield Observation(db_dependency_state["up"], {"dependency": "sqlite"})
@@ -50,9 +52,75 @@ def init_db():
         """)
         conn.commit()
 
+# Multi-row INSERT statements keyed by row count. Rows are chunked to stay under
+# SQLite's historical 999 bound-parameter limit (4 parameters per row).
+MAX_ROWS_PER_INSERT = 999 // 4
+_insert_sql = {}
+
+def insert_sql(row_count):
+    sql = _insert_sql.get(row_count)
+    if sql is None:
+        sql = _insert_sql[row_count] = (
+            "INSERT OR IGNORE INTO processed_events (event_id, timestamp, device_id, value) VALUES "
+            + ", ".join(["(?, ?, ?, ?)"] * row_count)
+        )
+    return sql
+
+def insert_events(conn, rows):
+    """Inserts rows in one write transaction, so the batch costs a single commit."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for i in range(0, len(rows), MAX_ROWS_PER_INSERT):
+            chunk = rows[i:i + MAX_ROWS_PER_INSERT]
+            conn.execute(insert_sql(len(chunk)), [v for row in chunk for v in row])
+        conn.execute("COMMIT")
+    except Exception:
+        # SQLite has already rolled back after some errors (e.g. SQLITE_FULL);
+        # a second ROLLBACK would raise and hide the original error
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+# Read-only connections for the health server, one per threadpool thread.
+# The worker thread keeps its own write connection (see process_events).
+_tls = threading.local()
+
+def db_inode():
+    try:
+        return os.stat(DB_PATH).st_ino
+    except OSError:
+        return None
+
+def get_conn():
+    conn = getattr(_tls, "conn", None)
+    if conn is not None and _tls.inode != db_inode():
+        # The file was removed or replaced; the cached handle would keep
+        # reading the old one
+        drop_conn()
+        conn = None
+    if conn is None:
+        # Read-only open fails, rather than creating the file, if the DB is missing
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, isolation_level=None)
+        _tls.conn = conn
+        _tls.inode = db_inode()
+    return conn
+
+def drop_conn():
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        _tls.conn = None
+        conn.close()
+
 # --- Worker Logic ---
+def parse_event(fields):
+    """Returns the processed_events row for a stream entry's fields."""
+    if "data" in fields:
+        # Entry written by an older ingest-api as a JSON blob
+        fields = json.loads(fields["data"])
+    return (fields["event_id"], fields["timestamp"], fields["device_id"], float(fields["value"]))
+
 def process_events():
-    redis_client = redis.Redis(host=REDIS_HOST, port=6379)
+    redis_client = redis.Redis(host=REDIS_HOST, port=6379, decode_responses=True)
     group_name = "processing_group"
     consumer_name = f"consumer-{os.getpid()}"
 
@@ -62,39 +130,66 @@ def process_events():
         if "already exists" not in str(e):
             raise
 
+    # One connection for the lifetime of the worker thread. Transactions are
+    # managed explicitly by insert_events, and the statement cache is large
+    # enough to hold an INSERT for every batch size.
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, cached_statements=MAX_ROWS_PER_INSERT + 16)
+    # Rollback journal, not WAL: query-api mounts /data read-only and cannot
+    # create the -wal/-shm files a WAL reader needs. This also converts a
+    # database left in WAL mode by an earlier version.
+    conn.execute("PRAGMA journal_mode=DELETE")
+
+    # "0" re-reads entries already delivered to this consumer but never acked
+    # (left over from a failed batch or a restart); once none remain, switch
+    # to new entries with ">".
+    read_id = "0"
+
     while True:
         try:
             messages = redis_client.xreadgroup(
-                group_name, consumer_name, {"events_stream": ">"}, count=1, block=1000
+                group_name, consumer_name, {"events_stream": read_id}, count=WORKER_BATCH_SIZE, block=1000
             )
             if not messages:
                 continue
 
-            worker_events_consumed.add(1)
-            start_time = time.time()
-
             stream, msg_list = messages[0]
-            msg_id, data = msg_list[0]
-            event_data = json.loads(data[b"data"])
-
-            if CPU_WORK_MS > 0:
-                busy_wait(CPU_WORK_MS)
-
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT OR IGNORE INTO processed_events (event_id, timestamp, device_id, value) VALUES (?, ?, ?, ?)",
-                    (event_data["event_id"], event_data["timestamp"], event_data["device_id"], event_data["value"])
-                )
-                conn.commit()
+            if not msg_list:
+                read_id = ">"
+                continue
 
-            redis_client.xack("events_stream", group_name, msg_id)
-            worker_events_processed.add(1)
-            worker_event_processing_duration.record(time.time() - start_time)
+            worker_events_consumed.add(len(msg_list))
+            start_time = time.perf_counter()
+
+            msg_ids = []
+            rows = []
+            for msg_id, fields in msg_list:
+                # Every entry is acked; unparseable ones (including entries
+                # trimmed from the stream, which come back without fields) are
+                # skipped so they don't hold back the rest of the batch.
+                msg_ids.append(msg_id)
+                try:
+                    rows.append(parse_event(fields))
+                except (KeyError, TypeError, ValueError) as e:
+                    worker_events_malformed.add(1)
+                    print(f"Skipping malformed entry {msg_id}: {e!r}")
+
+            if rows:
+                if CPU_WORK_MS > 0:
+                    busy_wait(CPU_WORK_MS * len(rows))
+
+                insert_events(conn, rows)
+
+            redis_client.xack("events_stream", group_name, *msg_ids)
+            if rows:
+                worker_events_processed.add(len(rows))
+                # Amortized per-event duration, keeping the histogram's meaning
+                worker_event_processing_duration.record((time.perf_counter() - start_time) / len(rows))
 
         except Exception as e:
             worker_loop_errors.add(1)
-            print(f"Error processing event: {e}")
+            print(f"Error processing events: {e}")
+            # Retry whatever this consumer was handed but did not ack
+            read_id = "0"
             time.sleep(1)
 
 # --- Health Check Server ---
@@ -107,11 +202,12 @@ def health_check():
 @app.get("/ready")
 def readiness_check(response: Response):
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.execute("SELECT 1")
+        # Reads a table page; a bare SELECT 1 succeeds without touching the file
+        get_conn().execute("SELECT 1 FROM processed_events LIMIT 1").fetchone()
         db_dependency_state["up"] = 1
         return {"status": "ok"}
     except Exception:
+        drop_conn()
         db_dependency_state["up"] = 0
         response.status_code = 503
         return {"status": "error", "details": "Database not reachable"}
@@ -1,18 +1,23 @@
 import os
 import sqlite3
+import threading
 import time
-from fastapi import FastAPI, Request, Response
-import redis
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
+from starlette.concurrency import run_in_threadpool
+import redis.asyncio as aioredis
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from opentelemetry.metrics import Observation
 
-from shared.observability import setup_observability, busy_wait
+from shared.observability import setup_observability, busy_wait, OtelMetricsMiddleware
 
 # --- Configuration ---
 SERVICE_NAME = os.environ.get("SERVICE_NAME", "query-api")
 DB_PATH = os.environ.get("DB_PATH", "events.db")
 REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
 CPU_WORK_MS = int(os.environ.get("CPU_WORK_MS", 0))
+READY_CACHE_TTL = float(os.environ.get("READY_CACHE_TTL", 1))
 
 # --- Observability ---
 tracer, meter = setup_observability(SERVICE_NAME)
@@ -37,33 +42,74 @@ meter.create_observable_gauge(
     description="Status of application dependencies (1 for up, 0 for down)",
 )
 
+# --- Database ---
+# sqlite3 connections must not be shared across threads, so each threadpool
+# worker keeps its own read-only connection open for reuse.
+_tls = threading.local()
+
+# Kept constant so the per-connection statement cache is hit on every lookup.
+# Answered from the primary key index alone, without reading the row.
+STATUS_SQL = "SELECT 1 FROM processed_events WHERE event_id = ? LIMIT 1"
+
+
+def db_inode():
+    try:
+        return os.stat(DB_PATH).st_ino
+    except OSError:
+        return None
+
+
+def get_conn():
+    conn = getattr(_tls, "conn", None)
+    if conn is not None and _tls.inode != db_inode():
+        # The file was removed or replaced; the cached handle would keep
+        # reading the old one
+        drop_conn()
+        conn = None
+    if conn is None:
+        # Read-only open also fails, rather than creating the file, if the DB is missing
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, isolation_level=None)
+        _tls.conn = conn
+        _tls.inode = db_inode()
+    return conn
+
+
+def drop_conn():
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        _tls.conn = None
+        conn.close()
+
+
+def check_db():
+    # Reads a table page; a bare SELECT 1 succeeds without touching the file
+    try:
+        get_conn().execute("SELECT 1 FROM processed_events LIMIT 1").fetchone()
+    except sqlite3.Error:
+        drop_conn()
+        raise
+
+
 # --- Application ---
-app = FastAPI()
-redis_client = redis.Redis(host=REDIS_HOST, port=6379, decode_responses=True)
-
-
-@app.middleware("http")
-async def otel_metrics_middleware(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    duration = time.time() - start_time
-
-    route = request.scope.get("route")
-    route_template = route.path_format if route else "unknown"
-
-    http_server_request_counter.add(1, {
-        "service": SERVICE_NAME,
-        "http.route": route_template,
-        "http.request.method": request.method,
-        "http.response.status_code": response.status_code,
-    })
-    http_server_request_duration.record(duration, {
-        "service": SERVICE_NAME,
-        "http.route": route_template,
-        "http.request.method": request.method,
-        "http.response.status_code": response.status_code,
-    })
-    return response
+# Created on startup so the client is bound to the server's event loop
+redis_client = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global redis_client
+    redis_client = aioredis.Redis(host=REDIS_HOST, port=6379, decode_responses=True)
+    yield
+    await redis_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(
+    OtelMetricsMiddleware,
+    service_name=SERVICE_NAME,
+    request_counter=http_server_request_counter,
+    request_duration=http_server_request_duration,
+)
 
 
 @app.get("/status/{event_id}")
@@ -73,14 +119,13 @@ def get_status(event_id: str):
             busy_wait(CPU_WORK_MS)
 
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT event_id FROM processed_events WHERE event_id = ?", (event_id,))
-                result = cursor.fetchone()
-                if result:
-                    return {"status": "processed"}
+            result = get_conn().execute(STATUS_SQL, (event_id,)).fetchone()
+            if result is not None:
+                return {"status": "processed"}
         except sqlite3.OperationalError:
-            # Handle cases where the DB might be locked or unavailable
+            # Handle cases where the DB might be locked or unavailable;
+            # reconnect on the next request
+            drop_conn()
             return {"status": "unknown"}
 
 
@@ -97,36 +142,36 @@ def health_check():
     return {"status": "ok"}
 
 
+# Monotonic time of the last successful readiness check
+ready_state = {"ok_at": None}
+
+
 @app.get("/ready")
-def readiness_check(response: Response):
-    db_ok = False
-    redis_ok = False
+async def readiness_check(response: Response):
+    ok_at = ready_state["ok_at"]
+    if ok_at is not None and time.monotonic() - ok_at < READY_CACHE_TTL:
+        return {"status": "ok"}
 
-    try:
-        with sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True) as conn:
-            conn.execute("SELECT 1")
-        db_ok = True
-        db_dependency_state["up"] = 1
-    except Exception:
-        db_dependency_state["up"] = 0
+    # Both dependencies are probed concurrently; the DB check runs in the
+    # threadpool so it reuses that thread's connection.
+    db_result, redis_result = await asyncio.gather(
+        run_in_threadpool(check_db), redis_client.ping(), return_exceptions=True
+    )
+
+    db_ok = not isinstance(db_result, Exception)
+    redis_ok = not isinstance(redis_result, Exception) and bool(redis_result)
+    db_dependency_state["up"] = int(db_ok)
+    redis_dependency_state["up"] = int(redis_ok)
+
+    if not db_ok:
         response.status_code = 503
         return {"status": "error", "details": "Database not reachable"}
-
-    try:
-        redis_ok = redis_client.ping()
-        if redis_ok:
-            redis_dependency_state["up"] = 1
-        else:
-            redis_dependency_state["up"] = 0
-            response.status_code = 503
-            return {"status": "error", "details": "Redis not reachable"}
-    except Exception:
-        redis_dependency_state["up"] = 0
+    if not redis_ok:
         response.status_code = 503
         return {"status": "error", "details": "Redis not reachable"}
 
-    if db_ok and redis_ok:
-        return {"status": "ok"}
+    ready_state["ok_at"] = time.monotonic()
+    return {"status": "ok"}
 
 
 # Instrument FastAPI - no tracer_provider needed if a global one is set
@@ -134,4 +179,8 @@ FastAPIInstrumentor.instrument_app(app)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8002)
+    # Single process: with workers > 1 this supervisor would have run
+    # setup_observability too and export idle series of its own. Use Gunicorn
+    # (GUNICORN_WORKERS) for several workers. uvloop and httptools come with
+    # uvicorn[standard].
+    uvicorn.run(app, host="0.0.0.0", port=8002, loop="uvloop", http="httptools", log_level="warning")
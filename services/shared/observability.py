@@ -1,19 +1,53 @@
 import os
-import time  # <-- ADDED THIS LINE
+import math
+import time
 from opentelemetry import trace
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBasedTraceIdRatio
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
 
 from opentelemetry import metrics
-from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics import MeterProvider, Histogram
 from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+from opentelemetry.sdk.metrics.view import View, ExplicitBucketHistogramAggregation
 from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
 
 from opentelemetry.sdk.resources import Resource, SERVICE_NAME, SERVICE_VERSION
 
+CPU_WORK_MODE = os.environ.get("CPU_WORK_MODE", "sleep")
+
+# Bucket boundaries for histograms with unit "s" (our duration histograms).
+# The SDK defaults (0..10000) are sized for milliseconds and would put nearly
+# all samples in the first buckets. Instrumentation histograms in ms or bytes
+# keep the defaults.
+DURATION_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5]
+
+def create_exporters():
+    """Returns the span and metric exporters for OTEL_EXPORTER_OTLP_PROTOCOL."""
+    protocol = os.environ.get("OTEL_EXPORTER_OTLP_PROTOCOL", "grpc")
+    if protocol == "http/protobuf":
+        from opentelemetry.exporter.otlp.proto.http import Compression
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter as HTTPSpanExporter
+        from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter as HTTPMetricExporter
+
+        # No explicit endpoint: the HTTP exporters derive the per-signal
+        # /v1/traces and /v1/metrics URLs from OTEL_EXPORTER_OTLP_ENDPOINT.
+        return (
+            HTTPSpanExporter(compression=Compression.Gzip),
+            HTTPMetricExporter(compression=Compression.Gzip),
+        )
+
+    endpoint = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+    return OTLPSpanExporter(endpoint=endpoint), OTLPMetricExporter(endpoint=endpoint)
+
 def setup_observability(service_name: str):
     """Configures OpenTelemetry for the application."""
+    # A second call (e.g. a reloaded module) would start another set of export
+    # threads that the global providers silently ignore; reuse the first setup.
+    if isinstance(trace.get_tracer_provider(), TracerProvider):
+        return trace.get_tracer(service_name), metrics.get_meter(service_name)
+
     resource = Resource(attributes={
         SERVICE_NAME: service_name,
         SERVICE_VERSION: "0.1.0",
@@ -21,25 +55,117 @@ def setup_observability(service_name: str):
         "deployment.environment": os.environ.get("DEPLOYMENT_ENVIRONMENT", "development"),
     })
 
+    trace_exporter, metric_exporter = create_exporters()
+
     # --- Tracing Setup ---
-    trace_provider = TracerProvider(resource=resource)
-    trace_exporter = OTLPSpanExporter(endpoint=os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"))
-    trace_provider.add_span_processor(BatchSpanProcessor(trace_exporter))
+    # Standard OTEL_* variables are honoured; the defaults here favour
+    # larger, less frequent exports and keep 10% of root traces. When
+    # OTEL_TRACES_SAMPLER is set the SDK builds the sampler from it.
+    if "OTEL_TRACES_SAMPLER" in os.environ:
+        sampler = None
+    else:
+        sampler = ParentBasedTraceIdRatio(float(os.environ.get("OTEL_TRACES_SAMPLER_ARG", 0.1)))
+    trace_provider = TracerProvider(resource=resource, sampler=sampler)
+    trace_provider.add_span_processor(BatchSpanProcessor(
+        trace_exporter,
+        max_queue_size=int(os.environ.get("OTEL_BSP_MAX_QUEUE_SIZE", 4096)),
+        max_export_batch_size=int(os.environ.get("OTEL_BSP_MAX_EXPORT_BATCH_SIZE", 1024)),
+        schedule_delay_millis=float(os.environ.get("OTEL_BSP_SCHEDULE_DELAY", 2000)),
+        export_timeout_millis=float(os.environ.get("OTEL_BSP_EXPORT_TIMEOUT", 5000)),
+    ))
     trace.set_tracer_provider(trace_provider)
 
     # --- Metrics Setup ---
     metric_reader = PeriodicExportingMetricReader(
-        OTLPMetricExporter(endpoint=os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"))
+        metric_exporter,
+        export_interval_millis=float(os.environ.get("OTEL_METRIC_EXPORT_INTERVAL", 10000)),
+        export_timeout_millis=float(os.environ.get("OTEL_METRIC_EXPORT_TIMEOUT", 5000)),
+    )
+    duration_view = View(
+        instrument_type=Histogram,
+        instrument_unit="s",
+        aggregation=ExplicitBucketHistogramAggregation(boundaries=DURATION_BUCKETS),
     )
-    meter_provider = MeterProvider(resource=resource, metric_readers=[metric_reader])
+    meter_provider = MeterProvider(resource=resource, metric_readers=[metric_reader], views=[duration_view])
     metrics.set_meter_provider(meter_provider)
 
     return trace.get_tracer(service_name), metrics.get_meter(service_name)
 
+# Attribute dicts per middleware are bounded so bogus routes cannot grow them
+# without limit.
+ATTR_CACHE_SIZE = 1024
+
+class OtelMetricsMiddleware:
+    """Pure ASGI middleware recording HTTP request count and duration."""
+
+    def __init__(self, app, service_name, request_counter, request_duration):
+        self.app = app
+        self.service_name = service_name
+        self.request_counter = request_counter
+        self.request_duration = request_duration
+        # (route, method, status) -> attribute dict shared by both instruments
+        self._attr_cache = {}
+
+    def request_attributes(self, route_template, method, status_code):
+        key = (route_template, method, status_code)
+        attrs = self._attr_cache.get(key)
+        if attrs is None:
+            if len(self._attr_cache) >= ATTR_CACHE_SIZE:
+                # FIFO eviction; dicts preserve insertion order
+                del self._attr_cache[next(iter(self._attr_cache))]
+            attrs = self._attr_cache[key] = {
+                "service": self.service_name,
+                "http.route": route_template,
+                "http.request.method": method,
+                "http.response.status_code": status_code,
+            }
+        return attrs
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start_time
+
+            # The router stores the matched route in this same scope during
+            # dispatch. Unmatched paths share "unknown" to keep label
+            # cardinality bounded.
+            route = scope.get("route")
+            route_template = route.path_format if route is not None else "unknown"
+
+            attrs = self.request_attributes(route_template, scope["method"], status_code)
+            self.request_counter.add(1, attrs)
+            self.request_duration.record(duration, attrs)
+
 def busy_wait(milliseconds: int):
-    """A simple busy-wait loop to simulate CPU work."""
+    """Simulates request work, selected by CPU_WORK_MODE ("sleep" or "spin")."""
+    if milliseconds <= 0:
+        return
+    if CPU_WORK_MODE == "spin":
+        cpu_burn(milliseconds)
+    else:
+        time.sleep(milliseconds / 1000.0)
+
+def cpu_burn(milliseconds: int):
+    """Keeps a core busy for the given time to simulate CPU-bound work."""
     if milliseconds <= 0:
         return
-    end_time = time.monotonic() + milliseconds / 1000.0
-    while time.monotonic() < end_time:
-        pass
+    end_time = time.perf_counter() + milliseconds / 1000.0
+    x = 0.0
+    while time.perf_counter() < end_time:
+        # Batch some arithmetic between clock reads
+        for i in range(1000):
+            x += math.sqrt(i)
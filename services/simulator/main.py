@@ -2,9 +2,8 @@ import os
 import time
 import datetime
 import uuid
-import threading
-import requests
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import httpx
 
 # Assuming 'shared' is in the python path
 from shared.observability import setup_observability
@@ -18,6 +17,8 @@ SIM_INGEST_RPS = int(os.environ.get("SIM_INGEST_RPS", 5))
 SIM_POLL_INTERVAL_SECONDS = float(os.environ.get("SIM_POLL_INTERVAL_SECONDS", 0.5))
 SIM_POLL_TIMEOUT_SECONDS = float(os.environ.get("SIM_POLL_TIMEOUT_SECONDS", 10))
 SIM_HEALTH_TIMEOUT_SECONDS = float(os.environ.get("SIM_HEALTH_TIMEOUT_SECONDS", 2))
+# Defaults to twice the RPS (the old thread pool size) so it scales with the load
+SIM_MAX_INFLIGHT = int(os.environ.get("SIM_MAX_INFLIGHT", SIM_INGEST_RPS * 2))
 HEALTH_CHECK_INTERVAL_SECONDS = 5
 
 # --- Observability ---
@@ -43,46 +44,48 @@ sim_inflight_tests = meter.create_up_down_counter(
     description="Number of in-flight functional smoke tests."
 )
 
+# --- HTTP Client ---
+# Shared keep-alive client, created in main() so it is bound to the running loop
+client = None
+
 # --- State for Downtime Calculation ---
 downtime_tracker = {
-    "ingest-api": {"up": True, "since": time.time()},
-    "query-api": {"up": True, "since": time.time()},
-    "functional": {"up": True, "since": time.time()}
+    "ingest-api": {"up": True, "since": time.monotonic()},
+    "query-api": {"up": True, "since": time.monotonic()},
+    "functional": {"up": True, "since": time.monotonic()}
 }
-downtime_lock = threading.Lock()
 
 def record_downtime(service: str, is_down: bool):
-    with downtime_lock:
-        state = downtime_tracker[service]
-        if is_down and state["up"]:
-            # Transition to DOWN
-            state["up"] = False
-            state["since"] = time.time()
-            print(f"DOWNTIME DETECTED for {service}")
-        elif not is_down and not state["up"]:
-            # Transition to UP
-            duration = time.time() - state["since"]
-            reason = "health_fail" if service != "functional" else "functional_fail"
-            sim_downtime_seconds.add(duration, {"target_service": service, "reason": reason})
-            state["up"] = True
-            state["since"] = time.time()
-            print(f"DOWNTIME RECOVERED for {service} after {duration:.2f}s")
-
-def instrumented_request(method, url, target_service, endpoint, **kwargs):
-    start_time = time.time()
+    state = downtime_tracker[service]
+    if is_down and state["up"]:
+        # Transition to DOWN
+        state["up"] = False
+        state["since"] = time.monotonic()
+        print(f"DOWNTIME DETECTED for {service}")
+    elif not is_down and not state["up"]:
+        # Transition to UP
+        duration = time.monotonic() - state["since"]
+        reason = "health_fail" if service != "functional" else "functional_fail"
+        sim_downtime_seconds.add(duration, {"target_service": service, "reason": reason})
+        state["up"] = True
+        state["since"] = time.monotonic()
+        print(f"DOWNTIME RECOVERED for {service} after {duration:.2f}s")
+
+async def instrumented_request(method, url, target_service, endpoint, **kwargs):
+    start_time = time.perf_counter()
     result = "ok"
     try:
-        response = requests.request(method, url, **kwargs)
+        response = await client.request(method, url, **kwargs)
         response.raise_for_status()
         return response
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         result = "timeout"
         raise
-    except requests.exceptions.RequestException:
+    except httpx.HTTPError:
         result = "error"
         raise
     finally:
-        duration = time.time() - start_time
+        duration = time.perf_counter() - start_time
         sim_client_request_count.add(1, {
             "target_service": target_service,
             "endpoint": endpoint,
@@ -93,29 +96,29 @@ def instrumented_request(method, url, target_service, endpoint, **kwargs):
             "endpoint": endpoint
         })
 
-def run_health_checks(stop_event: threading.Event):
+async def run_health_checks():
     """Periodically checks the health of dependent services."""
-    while not stop_event.is_set():
+    while True:
         # Check Ingest API
         try:
-            instrumented_request("GET", f"{INGEST_API_URL}/health", "ingest-api", "/health", timeout=SIM_HEALTH_TIMEOUT_SECONDS)
+            await instrumented_request("GET", f"{INGEST_API_URL}/health", "ingest-api", "/health", timeout=SIM_HEALTH_TIMEOUT_SECONDS)
             record_downtime("ingest-api", is_down=False)
         except Exception:
             record_downtime("ingest-api", is_down=True)
 
         # Check Query API
         try:
-            instrumented_request("GET", f"{QUERY_API_URL}/health", "query-api", "/health", timeout=SIM_HEALTH_TIMEOUT_SECONDS)
+            await instrumented_request("GET", f"{QUERY_API_URL}/health", "query-api", "/health", timeout=SIM_HEALTH_TIMEOUT_SECONDS)
             record_downtime("query-api", is_down=False)
         except Exception:
             record_downtime("query-api", is_down=True)
 
-        time.sleep(HEALTH_CHECK_INTERVAL_SECONDS)
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL_SECONDS)
 
-def functional_test_worker():
+async def functional_test_worker():
     """Represents a single user journey: ingest -> poll until processed."""
     sim_inflight_tests.add(1)
-    test_start_time = time.time()
+    test_start_time = time.perf_counter()
     event_id = None
     try:
         # 1. Ingest event
@@ -124,14 +127,14 @@ def functional_test_worker():
             "device_id": f"device_{uuid.uuid4()}",
             "value": 123.45
         }
-        response = instrumented_request("POST", f"{INGEST_API_URL}/ingest", "ingest-api", "/ingest", json=payload, timeout=5)
+        response = await instrumented_request("POST", f"{INGEST_API_URL}/ingest", "ingest-api", "/ingest", json=payload, timeout=5)
         event_id = response.json()["event_id"]
 
         # 2. Poll for status
-        poll_deadline = time.time() + SIM_POLL_TIMEOUT_SECONDS
-        while time.time() < poll_deadline:
+        poll_deadline = time.monotonic() + SIM_POLL_TIMEOUT_SECONDS
+        while time.monotonic() < poll_deadline:
             try:
-                status_response = instrumented_request("GET", f"{QUERY_API_URL}/status/{event_id}", "query-api", "/status/{event_id}", timeout=2)
+                status_response = await instrumented_request("GET", f"{QUERY_API_URL}/status/{event_id}", "query-api", "/status/{event_id}", timeout=2)
                 status = status_response.json().get("status")
                 if status == "processed":
                     record_downtime("functional", is_down=False)
@@ -139,7 +142,7 @@ def functional_test_worker():
             except Exception:
                 # Ignore individual poll errors, rely on timeout
                 pass
-            time.sleep(SIM_POLL_INTERVAL_SECONDS)
+            await asyncio.sleep(SIM_POLL_INTERVAL_SECONDS)
 
         # 3. If we reach here, it's a timeout
         print(f"Functional test TIMEOUT for event {event_id}")
@@ -152,32 +155,41 @@ def functional_test_worker():
         sim_inflight_tests.add(-1)
 
 
-def main():
+async def main():
+    global client
     print("--- Starting Simulator ---")
     print(f"Duration: {SIM_DURATION_SECONDS}s, RPS: {SIM_INGEST_RPS}")
     print(f"Ingest API: {INGEST_API_URL}, Query API: {QUERY_API_URL}")
 
-    stop_event = threading.Event()
-    health_thread = threading.Thread(target=run_health_checks, args=(stop_event,), daemon=True)
-    health_thread.start()
+    client = httpx.AsyncClient(limits=httpx.Limits(max_connections=SIM_MAX_INFLIGHT + 1))
+    health_task = asyncio.create_task(run_health_checks())
+
+    # Bounds concurrent journeys; extra arrivals wait for a free slot
+    inflight = asyncio.Semaphore(SIM_MAX_INFLIGHT)
+    tests = set()
+
+    async def bounded_test():
+        async with inflight:
+            await functional_test_worker()
+
+    loop = asyncio.get_running_loop()
+    interval = 1.0 / SIM_INGEST_RPS
+    simulation_end_time = loop.time() + SIM_DURATION_SECONDS
+    next_start = loop.time()
 
-    executor = ThreadPoolExecutor(max_workers=SIM_INGEST_RPS * 2)
-    simulation_end_time = time.time() + SIM_DURATION_SECONDS
-    
     print("Simulation running...")
-    while time.time() < simulation_end_time:
-        start_of_second = time.time()
-        for _ in range(SIM_INGEST_RPS):
-            executor.submit(functional_test_worker)
-        
-        # Maintain RPS rate
-        elapsed = time.time() - start_of_second
-        sleep_time = max(0, 1.0 - elapsed)
-        time.sleep(sleep_time)
+    while next_start < simulation_end_time:
+        # Evenly spaced arrivals, scheduled against absolute times so they don't drift
+        await asyncio.sleep(max(0, next_start - loop.time()))
+        task = asyncio.create_task(bounded_test())
+        tests.add(task)
+        task.add_done_callback(tests.discard)
+        next_start += interval
 
     print("Simulation duration ended. Shutting down...")
-    stop_event.set()
-    executor.shutdown(wait=True)
+    health_task.cancel()
+    await asyncio.gather(*tests, return_exceptions=True)
+    await client.aclose()
     # Final flush of any ongoing downtime
     record_downtime("ingest-api", is_down=False)
     record_downtime("query-api", is_down=False)
@@ -186,4 +198,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())